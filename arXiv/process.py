@@ -1,14 +1,10 @@
 import os
 import re
-import time
 import json
 import logging
-from datetime import datetime, timezone
 from configparser import ConfigParser
 from collections import defaultdict
 
-import arxiv
-
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -26,12 +22,17 @@ config_path = os.path.abspath(os.path.join(cwd, '..', 'config.ini'))
 config = ConfigParser()
 config.read(config_path)
 
-sort_by_dict = {'relevance': arxiv.SortCriterion.Relevance,
-                'lastUpdatedDate': arxiv.SortCriterion.LastUpdatedDate,
-                'submittedDate': arxiv.SortCriterion.SubmittedDate}
+# arxiv在爬取时才导入,这里只记录对应的枚举名
+sort_by_dict = {'relevance': 'Relevance',
+                'lastUpdatedDate': 'LastUpdatedDate',
+                'submittedDate': 'SubmittedDate'}
+
+sort_order_dict = {'descending': 'Descending',
+                    'ascending': 'Ascending'}
 
-sort_order_dict = {'descending': arxiv.SortOrder.Descending,
-                    'ascending': arxiv.SortOrder.Ascending}
+# markdown中单篇论文条目的解析规则,模式固定,模块加载时编译一次
+# ID与PDF链接使用限定字符集,避免不完整条目上的大量回溯
+md_entry_prog = re.compile(r'<summary>(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) - (.*)<\/summary>\n\n- \*(.+)\*\n\n- `([^`\n]+)`[^\n]* \[pdf\]\(([^)\n]+)\)\n\n> (.+)\n\n<\/details>')
 
 
 def load_set(subject):
@@ -44,18 +45,31 @@ def load_set(subject):
     elif not os.path.exists(arxiv_db_set):
         return set(), arxiv_db_path
     else:
-        # 读取已存在的
+        # 读取已存在的,每行一个ID
         with open(arxiv_db_set, "r") as f:
-            tmp = json.loads(f.read())
-        return set(tmp), arxiv_db_path
+            raw = f.read()
+        # 忽略开头的BOM和空白判断是否为旧版本的JSON列表
+        stripped = raw.lstrip('\ufeff \t\r\n')
+        legacy = stripped.startswith('[')
+        if legacy:
+            db_set = set(json.loads(stripped))
+        else:
+            db_set = set(stripped.splitlines())
+            db_set.discard('')
+        if legacy:
+            # 旧版本为单个JSON列表,转换为每行一个ID,之后只需追加写入
+            # 先写临时文件再替换,中断时不会留下不完整的数据库
+            with open(arxiv_db_set + '.tmp', "w") as f:
+                f.writelines(short_id + '\n' for short_id in sorted(db_set))
+            os.replace(arxiv_db_set + '.tmp', arxiv_db_set)
+        return db_set, arxiv_db_path
 
 
 def load_markdown(markdown_fp):
     with open(markdown_fp, "r", encoding='utf-8') as f:
         raw_markdown = f.read()
 
-    prog = re.compile(r'<summary>(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) - (.*)<\/summary>\n\n- \*(.+)\*\n\n- `(.+)`.* \[pdf\]\((.+)\)\n\n> (.+)\n\n<\/details>')
-    matches = prog.findall(raw_markdown)
+    matches = md_entry_prog.findall(raw_markdown)
 
     results = []
 
@@ -63,8 +77,8 @@ def load_markdown(markdown_fp):
         ori = {}
         ori['title'] = result[1]
         ori['authors'] = result[2].split(', ')
-        ori['updated_sorted'] = time.strptime(result[0], '%Y-%m-%d %H:%M:%S')
         ori['updated'] = result[0]
+        ori['ym'] = result[0][:7]
         ori['summary'] = result[5]
         ori['pdf_url'] = result[4]
         ori['short_id'] = result[3]
@@ -72,76 +86,89 @@ def load_markdown(markdown_fp):
     return results
 
 
+def create_arxiv_client(page_size):
+    import arxiv
+
+    # client配置,每5秒一个API请求,出错重试5次
+    # 整个运行只创建一个client,其内部的requests.Session保持keep-alive连接,
+    # 所有主题和关键字的翻页请求都复用该连接
+    return arxiv.Client(
+        page_size=int(page_size),
+        delay_seconds=5,
+        num_retries=5
+    )
+
+
 def crawler(query,
             sort_by,
             sort_order,
             page_size,
             subjectcategory,
             max_results=float('inf')):
+    import arxiv
+
     # 参数处理
     query = json.loads(query)
-    subjectcategory = json.loads(subjectcategory)
+    subjectcategory = frozenset(json.loads(subjectcategory))
     max_results = int(max_results) if isinstance(max_results, str) else max_results
+    sort_by = getattr(arxiv.SortCriterion, sort_by_dict[sort_by])
+    sort_order = getattr(arxiv.SortOrder, sort_order_dict[sort_order])
 
     logger.info(f"开始爬取，查询: {query}, 最大结果数: {max_results}")
 
-    # client配置,每5秒一个API请求,出错重试5次
-    client = arxiv.Client(
-        page_size=int(page_size),
-        delay_seconds=5,
-        num_retries=5
-    )
+    client = create_arxiv_client(page_size)
 
     for subject, key_words in query.items():
         logger.info(f"开始处理主题: {subject}")
         query_results = defaultdict(list)
         db_set, arxiv_db_path = load_set(subject)
+        new_ids = []
         logger.info(f"已加载 {len(db_set)} 条历史记录")
 
+        def accepted(results):
+            outside_category = subjectcategory.isdisjoint
+            for result in results:
+                # 是否在指定的类别内
+                if outside_category(result.categories):
+                    continue
+
+                # 数据库中是否已存在
+                short_id = result.get_short_id()
+                if short_id in db_set:
+                    continue
+                db_set.add(short_id)
+                new_ids.append(short_id)
+                yield result, short_id
+
         # 每个关键字一个查询请求
         for key_word in key_words:
             logger.info(f"搜索关键词: {key_word}")
             search = arxiv.Search(
                 query=key_word,
                 max_results=max_results,
-                sort_by=sort_by_dict[sort_by],
-                sort_order=sort_order_dict[sort_order]
+                sort_by=sort_by,
+                sort_order=sort_order
             )
 
             try:
                 paper_count = 0
                 
                 # 使用正确的当前API：使用 client.results(search)
-                for result in client.results(search):
-                    # 是否在指定的类别内
-                    for cate in result.categories:
-                        if cate in subjectcategory:
-                            break
-                    else:
-                        continue
-
-                    # 数据库中是否已存在
-                    short_id = result.get_short_id()
-                    if short_id in db_set:
-                        continue
-                    db_set.add(short_id)
-
-                    year = result.updated.year
+                for result, short_id in accepted(client.results(search)):
                     ori = dict()
                     ori['title'] = result.title
                     ori['authors'] = [author.name for author in result.authors]
-                    ori['updated_sorted'] = result.updated
                     ori['updated'] = result.updated.strftime('%Y-%m-%d %H:%M:%S')
+                    ori['ym'] = ori['updated'][:7]
                     ori['summary'] = result.summary.replace('\n', ' ')
-                    # 获取 PDF URL - 直接构建 URL
-                    short_id = result.get_short_id()
+                    # 获取 PDF URL - 直接构建 URL,复用前面取得的 short_id
                     ori['pdf_url'] = f"http://arxiv.org/pdf/{short_id}"
-                    ori['short_id'] = result.get_short_id()
-                    query_results[year].append(ori)
+                    ori['short_id'] = short_id
+                    query_results[result.updated.year].append(ori)
                     
                     paper_count += 1
                     if paper_count % 10 == 0:
-                        logger.info(f"已处理 {paper_count} 篇论文")
+                        logger.info(f"{subject}--{key_word}: 已处理 {paper_count} 篇论文")
             except arxiv.UnexpectedEmptyPageError:
                 logger.warning(f"{subject}--{key_word}: arxiv.UnexpectedEmptyPageError")
             except arxiv.HTTPError:
@@ -154,69 +181,48 @@ def crawler(query,
             markdown_fp = os.path.join(arxiv_db_path, f'{year}.md')
             if os.path.exists(markdown_fp):
                 old_results = load_markdown(markdown_fp)
-                query_set = set([item['short_id'] for item in old_results])
-                for item in results:
-                    if item['short_id'] not in query_set:
-                        old_results.append(item)
+                query_set = {item['short_id'] for item in old_results}
+                old_results.extend(item for item in results if item['short_id'] not in query_set)
                 results = old_results
                 
-            # 标准化时间格式以便排序
-            def get_sort_key(item):
-                updated_sorted = item['updated_sorted']
-                if isinstance(updated_sorted, time.struct_time):
-                    # 转换 struct_time 为 datetime
-                    dt = datetime.fromtimestamp(time.mktime(updated_sorted))
-                    # 如果原时间是 UTC，添加 UTC 时区信息
-                    return dt.replace(tzinfo=timezone.utc)
-                elif isinstance(updated_sorted, datetime):
-                    # 已经是 datetime 对象
-                    if updated_sorted.tzinfo is None:
-                        # 如果没有时区信息，假设是 UTC
-                        return updated_sorted.replace(tzinfo=timezone.utc)
-                    else:
-                        return updated_sorted
-                else:
-                    # 尝试解析字符串
-                    try:
-                        dt = datetime.strptime(updated_sorted, '%Y-%m-%d %H:%M:%S')
-                        return dt.replace(tzinfo=timezone.utc)
-                    except:
-                        return datetime.min.replace(tzinfo=timezone.utc)
-            
-            results = sorted(results, key=get_sort_key)
-
-            markdown = []
-            markdown.append(f"# {year}\n")
-
-            toc = []
-            content = defaultdict(list)
-            for result in results:
-                ym = result['updated'].rsplit('-', 1)[0]
-                if ym not in toc:
-                    toc.append(ym)
-                paper = f"<details>\n\n<summary>{result['updated']} - {result['title']}</summary>\n\n" \
-                        f"- *{', '.join(result['authors'])}*\n\n" \
-                        f"- `{result['short_id']}` - [abs](http://arxiv.org/abs/{result['short_id']}) - [pdf]({result['pdf_url']})\n\n" \
-                        f"> {result['summary']}\n\n" \
-                        f"</details>\n\n"
-                content[ym].append(paper)
-
-            markdown.append("## TOC\n")
-            toc = sorted(toc)
-            markdown.append("\n".join([f"- [{t}](#{t})" for t in toc])+'\n')
-
-            for ym, papers in content.items():
-                markdown.append(f"## {ym}\n")
-                markdown.append("".join(papers))
-
-            with open(markdown_fp, "w", encoding='utf-8') as f:
-                f.write("\n".join(markdown))
-
-        if len(query_results) > 0:
-            with open(os.path.join(arxiv_db_path, 'db.txt'), "w") as f:
-                db_str = json.dumps(list(db_set))
-                f.write(db_str)
-                logger.info(f"已保存 {len(db_set)} 条记录到数据库")
+            # updated均为UTC时间,格式固定,按字符串排序即为按时间排序
+            results = sorted(results, key=lambda item: item['updated'])
+
+            toc = sorted({result['ym'] for result in results})
+
+            # 结果已按时间排序,同一月份的论文相邻,逐篇直接写入文件,遇到新月份时写入标题
+            # 先写临时文件再替换,中断时保留原文件,避免下次解析不完整的markdown
+            with open(markdown_fp + '.tmp', "w", encoding='utf-8', buffering=1 << 20) as f:
+                f.write(f"# {year}\n\n## TOC\n\n")
+                f.writelines(f"- [{t}](#{t})\n" for t in toc)
+                prev_ym = None
+                for result in results:
+                    ym = result['ym']
+                    if ym != prev_ym:
+                        f.write(f"\n## {ym}\n\n")
+                        prev_ym = ym
+                    paper = f"<details>\n\n<summary>{result['updated']} - {result['title']}</summary>\n\n" \
+                            f"- *{', '.join(result['authors'])}*\n\n" \
+                            f"- `{result['short_id']}` - [abs](http://arxiv.org/abs/{result['short_id']}) - [pdf]({result['pdf_url']})\n\n" \
+                            f"> {result['summary']}\n\n" \
+                            f"</details>\n\n"
+                    f.write(paper)
+            os.replace(markdown_fp + '.tmp', markdown_fp)
+
+        # 只追加本次新增的ID,无需重写整个数据库
+        if len(new_ids) > 0:
+            db_fp = os.path.join(arxiv_db_path, 'db.txt')
+            # 文件末尾缺少换行时先补上,避免第一个新ID接在最后一行后面
+            missing_newline = False
+            if os.path.exists(db_fp) and os.path.getsize(db_fp) > 0:
+                with open(db_fp, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    missing_newline = f.read(1) != b'\n'
+            with open(db_fp, "a", buffering=1 << 20) as f:
+                if missing_newline:
+                    f.write('\n')
+                f.writelines(short_id + '\n' for short_id in new_ids)
+                logger.info(f"已保存 {len(new_ids)} 条新记录到数据库, 共 {len(db_set)} 条")
 
 
 if __name__ == '__main__':